@@ -6,6 +6,9 @@ import sys
 import random
 from collections import Counter
 import time
+import os
+import math
+import pickle
 from matplotlib import pyplot as plt
 
 class Gibbs():
@@ -34,11 +37,29 @@ class Gibbs():
     NumSampleIgnr   - Number of Initial Samples to be ignored before computing the final probability          -d
     [Prefix Required for no. of updates and ignored no. of samples]
 
+    --Checkpointing - Optional values
+    --checkpoint       - File the sampler state is periodically written to, and once more when the run finishes
+    --checkpoint-every - Seconds between two checkpoints (defaults to 300)
+    --resume           - Continue the run stored in the checkpoint file, run with the same query, evidence and -d
+                         (-u may be left out, the checkpointed number of updates is used)
+
+    --Parallel tempering - Optional values
+    --temperatures     - Comma separated finite increasing temperatures of the replicas, the first one must be 1 (defaults to plain Gibbs)
+    --swap-every       - Sweeps between two rounds of swap proposals between neighbouring replicas (defaults to 1)
+
+    --Pruning - Optional value
+    Barren and d-separated nodes are removed given the query and evidence and only the rest is sampled
+    --no-prune         - Sample every non-evidence node
+
     -- Input Syntax
-    gibbs.py [-h] [E1] [E2] [E3] [E4] [E5] [E6] [E7] [E8] [-u U] [-d D]
+    gibbs.py [-h] [E1] [E2] [E3] [E4] [E5] [E6] [E7] [E8] [-u U] [-d D] [--checkpoint FILE] [--checkpoint-every SECS] [--resume]
+                     [--temperatures T1,T2,...] [--swap-every N] [--no-prune]
 
     -- Example Input command
     python3 gibbs.py location neighborhood=good amenities=lots -u 10000 -d 500
+    python3 gibbs.py location price=expensive -u 1000000000 --checkpoint run.ckpt
+    python3 gibbs.py location price=expensive -u 1000000000 --checkpoint run.ckpt --resume
+    python3 gibbs.py location price=expensive -u 100000 --temperatures 1,2,4,8
     '''
 
     def __init__(self):
@@ -56,16 +77,46 @@ class Gibbs():
         self.schooOptions = ['bad', 'good']
         self.ageOptions = ['old', 'new']
         self.allNodes = ['location', 'age', 'schools', 'children', 'neighborhood', 'price', 'size', 'amenities']
+        self.nodeOptions = {'location': self.locOptions, 'age': self.ageOptions, 'schools': self.schooOptions, 'children': self.childOptions,
+                            'neighborhood': self.neighOptions, 'price': self.priceOptions, 'size': self.sizeOptions, 'amenities': self.amenitiesOptions}
+
+        #Network structure - parents of every node in the order the matching CPT function takes them
+        self.parents = {'amenities': [], 'neighborhood': [], 'location': ['amenities', 'neighborhood'], 'children': ['neighborhood'],
+                        'size': [], 'schools': ['children'], 'age': ['location'], 'price': ['location', 'age', 'schools', 'size']}
+        self.cptFunctions = {'amenities': self.CPT_amentiies, 'neighborhood': self.CPT_neighbor, 'location': self.CPT_location,
+                             'children': self.CPT_children, 'size': self.CPT_size, 'schools': self.CPT_schools,
+                             'age': self.CPT_age, 'price': self.CPT_price}
         
-        self.locationStates = {}
-        self.neighborhoodStates = {}
-        self.amenitiesStates = {}
-        self.childrenStates = {}
-        self.sizeStates = {}
-        self.schoolsStates = {}
-        self.ageStates = {}
-        self.priceStates = {}
         self.evidLis = []
+
+        #Estimator accumulators of the query node - counts of its states after the ignored samples and batch means for the ESS
+        self.ignoredSweeps = 0
+        self.batchSize = 1
+        self.queryCounts = Counter()
+        self.batchCounts = Counter()
+        self.batchFill = 0
+        self.batchSums = Counter()
+        self.batchSquares = Counter()
+        self.numBatches = 0
+
+        self.checkpointFile = None
+        self.checkpointEvery = 0
+        self.resume = False
+        self.samplingTime = 0.0
+
+        self.temperatures = [1.0]
+        self.swapEvery = 1
+        self.swapAttempts = []
+        self.swapAccepts = []
+
+        #Query-driven pruning - filled in by prune_network
+        self.prune = True
+        self.reducedModel = False
+        self.barrenNodes = []
+        self.dseparatedNodes = []
+        self.sampledNodes = []
+        self.factorNodes = list(self.allNodes)
+        self.reducedChildren = {}
         
     def read_argument(self):
 
@@ -75,12 +126,44 @@ class Gibbs():
         parser.add_argument('EvidenceNodes',  nargs='*', type=str, help='An evidence node value - Optional Value')
         parser.add_argument('-u', type=int, help='Number of Updates to be made')
         parser.add_argument('-d', type=int, help='Number of Updates to ignore before computing probability', default = 0)
+        parser.add_argument('--checkpoint', type=str, help='File to write periodic checkpoints of the sampler to', default = None)
+        parser.add_argument('--checkpoint-every', type=float, help='Seconds between two checkpoints', default = 300)
+        parser.add_argument('--resume', action='store_true', help='Continue the run saved in the --checkpoint file')
+        parser.add_argument('--temperatures', type=str, help='Comma separated increasing replica temperatures for parallel tempering, starting with 1', default = '1')
+        parser.add_argument('--swap-every', type=int, help='Number of sweeps between two replica swap proposals', default = 1)
+        parser.add_argument('--no-prune', action='store_true', help='Sample every non-evidence node instead of only the nodes relevant to the query')
 
         args = parser.parse_args()
 
         self.numUpdates = args.u
         self.numSampleIgnr = args.d
         self.QueryNode = args.QueryNode
+        self.checkpointFile = args.checkpoint
+        self.checkpointEvery = args.checkpoint_every if args.checkpoint else 0
+        self.resume = args.resume
+
+        if self.resume and not self.checkpointFile:
+            sys.exit("\n--resume needs the --checkpoint file to resume from")
+        if not math.isfinite(args.checkpoint_every) or args.checkpoint_every <= 0:
+            sys.exit("\n--checkpoint-every must be a positive number of seconds")
+        if self.checkpointFile:
+            checkpointDir = os.path.dirname(os.path.abspath(self.checkpointFile))
+            if not os.path.isdir(checkpointDir) or not os.access(checkpointDir, os.W_OK):
+                sys.exit("\nCheckpoint directory " + checkpointDir + " does not exist or is not writable")
+
+        try:
+            self.temperatures = [float(temperature) for temperature in args.temperatures.split(',')]
+        except ValueError:
+            sys.exit("\n--temperatures must be a comma separated list of numbers, for example 1,2,4")
+        self.swapEvery = args.swap_every
+        self.prune = not args.no_prune
+        if not all(math.isfinite(temperature) for temperature in self.temperatures) or self.temperatures[0] != 1.0\
+           or any(high <= low for low, high in zip(self.temperatures, self.temperatures[1:])):
+            sys.exit("\nTemperatures must be finite, start at 1 and increase, swaps are only proposed between neighbours in the list")
+        if self.swapEvery < 1:
+            sys.exit("\n--swap-every must be a positive number of sweeps")
+        self.swapAttempts = [0]*(len(self.temperatures)-1)
+        self.swapAccepts = [0]*(len(self.temperatures)-1)
 
         for nodeValue in args.EvidenceNodes:
             self.evidLis.append(nodeValue)
@@ -301,6 +384,14 @@ class Gibbs():
             print ("\nQuery Node cannot  be an evidence node as well")
             sys.exit("\nChange the inputs \nTerminating the process \nProcess has died - No PID generated - Pretending to be a pro coder")
 
+        if self.QueryNode not in self.allNodes:
+            print ("\nQuery Node", self.QueryNode, "is not a node of the network -- ", self.allNodes)
+            sys.exit("\nChange the inputs \nTerminating the process")
+
+        self.prune_network()
+        print ("Barren nodes pruned -- ", self.barrenNodes)
+        print ("d-separated nodes pruned -- ", self.dseparatedNodes)
+
         print ("---------------")
         for element in self.allNodes:
             # print (element)
@@ -312,8 +403,99 @@ class Gibbs():
         # print ("Evidence List", self.inpevidenceList)
         return newdict, self.inpevidenceList, self.numUpdates, self.numSampleIgnr, self.QueryNode
 
+    #Defining the query-driven pruning of the network before sampling
+    def prune_network(self):
+
+        '''Remove the nodes that cannot influence the query given the evidence.
+           Barren nodes - non-evidence nodes without evidence or query below them - are removed leaf by leaf,
+           their CPTs sum to one and drop out of the joint. In what remains, a node is d-separated from the query
+           exactly when it is disconnected from it in the moral graph once the evidence nodes are taken out.
+           Only the non-evidence nodes connected to the query are sampled, using only the CPTs that mention them '''
+
+        evidenceNodes = set(self.inpevidenceList)
+        remaining = set(self.allNodes)
+        self.barrenNodes, self.dseparatedNodes = [], []
+
+        children = {node: [] for node in self.allNodes}
+        for node in self.allNodes:
+            for parent in self.parents[node]:
+                children[parent].append(node)
+
+        if self.prune:
+            #Leaves are removed first, a parent becomes a leaf once all of its children are gone
+            remainingChildren = {node: len(children[node]) for node in self.allNodes}
+            leaves = [node for node in self.allNodes if remainingChildren[node] == 0]
+            for node in leaves:
+                if node == self.QueryNode or node in evidenceNodes:
+                    continue
+                remaining.discard(node)
+                self.barrenNodes.append(node)
+                for parent in self.parents[node]:
+                    remainingChildren[parent] -= 1
+                    if remainingChildren[parent] == 0:
+                        leaves.append(parent)
+
+        #Moral graph of the remaining nodes - every node linked to its parents and the parents linked to each other
+        moralNeighbours = {node: set() for node in remaining}
+        for node in remaining:
+            family = [node] + self.parents[node]
+            for member in family:
+                moralNeighbours[member].update(other for other in family if other != member)
+
+        connected = set([self.QueryNode])
+        toVisit = [self.QueryNode]
+        while toVisit:
+            node = toVisit.pop()
+            for neighbour in moralNeighbours[node]:
+                if neighbour not in evidenceNodes and neighbour not in connected:
+                    connected.add(neighbour)
+                    toVisit.append(neighbour)
+
+        if self.prune:
+            self.dseparatedNodes = [node for node in self.allNodes if node in remaining and node not in connected and node not in evidenceNodes]
+            self.sampledNodes = [node for node in self.allNodes if node in connected]
+            self.factorNodes = [node for node in self.allNodes if node in remaining and connected.intersection([node] + self.parents[node])]
+        else:
+            self.sampledNodes = [node for node in self.allNodes if node not in evidenceNodes]
+            self.factorNodes = list(self.allNodes)
+
+        self.reducedModel = bool(self.barrenNodes or self.dseparatedNodes)
+        factorNodes = set(self.factorNodes)
+        self.reducedChildren = {node: [child for child in children[node] if child in factorNodes] for node in self.sampledNodes}
+
+        return self.sampledNodes
+
+    #Defining the value of the CPT entry of a node for the assignment in totalList
+    def node_factor(self, node, totalList):
+        return self.cptFunctions[node](totalList[node], *[totalList[parent] for parent in self.parents[node]])
+
+    def probability_reduced(self, node, nonevidList, inpevidenceList, beta = 1.0):
+
+        '''Calculate the probability distribution for a node of the pruned network from its own CPT and
+           the CPTs of its children that were kept, then normalizing it to get it within the 0-1 range '''
+
+        nonevidList.update(inpevidenceList) #Concatenates nonevidence and input evidence lists
+        totalList = nonevidList
+
+        #Trying every option in place, the caller overwrites the node with the sampled value
+        prob_nodeNewnoNorm, prob_nodeNewNormal = {}, {}
+        for nodeOption in self.nodeOptions[node]:
+            totalList[node] = nodeOption
+            prob_nodeNewnoNorm[nodeOption] = self.node_factor(node, totalList)
+            for child in self.reducedChildren[node]:
+                prob_nodeNewnoNorm[nodeOption] *= self.node_factor(child, totalList)
+
+        if beta != 1.0:
+            prob_nodeNewnoNorm = {key: value**beta for key, value in prob_nodeNewnoNorm.items()}
+        summ = sum(list(prob_nodeNewnoNorm.values()))
+        for key in list(prob_nodeNewnoNorm.keys()):
+            prob_nodeNewNormal[key] = prob_nodeNewnoNorm[key]/summ
+
+        Update_value = str(np.random.choice(self.nodeOptions[node],p=[prob_nodeNewNormal[key] for key in self.nodeOptions[node]]))
+        return Update_value
+
     #Defining the functions for all the nodes to update their probability distribution for random assignment conditioned on the Markov Blanket
-    def probability_location(self, nonevidList, inpevidenceList):
+    def probability_location(self, nonevidList, inpevidenceList, beta = 1.0):
 
         '''Calculate the probability distribution for location node based on Markov Blanket and then
            normalizing it to get it within the 0-1 range '''
@@ -334,6 +516,8 @@ class Gibbs():
                             loc_nodeOption, totalList['age'], totalList['schools'], totalList['size'])
         
         #p(location|amenities,neighborhood)*p()
+        if beta != 1.0:
+            prob_locationNewnoNorm = {key: value**beta for key, value in prob_locationNewnoNorm.items()}
         summ = sum(list(prob_locationNewnoNorm.values()))
         for key in list(prob_locationNewnoNorm.keys()):
             prob_locationNewNormal[key] = prob_locationNewnoNorm[key]/summ
@@ -341,11 +525,11 @@ class Gibbs():
 #        print ("Probability distribution of the -- Location -- node without normalization", prob_locationNewnoNorm)
 #        print ("Probability distribution of the -- Location -- node with normalization", prob_locationNewNormal)
         
-        Update_value = np.random.choice(['good','bad','ugly'],p=[prob_locationNewNormal['good'],prob_locationNewNormal['bad'],prob_locationNewNormal['ugly']])
+        Update_value = str(np.random.choice(['good','bad','ugly'],p=[prob_locationNewNormal['good'],prob_locationNewNormal['bad'],prob_locationNewNormal['ugly']]))
         return Update_value
 
 
-    def probability_amenities(self, nonevidList, inpevidenceList):
+    def probability_amenities(self, nonevidList, inpevidenceList, beta = 1.0):
 
         '''Calculate the probability distribution for amenities node based on Markov Blanket and then
            normalizing it to get it within the 0-1 range '''
@@ -364,6 +548,8 @@ class Gibbs():
                             *self.CPT_amentiies(amn_nodeOption)*self.CPT_neighbor(totalList['neighborhood'])
         
         #p(location|amenities,neighborhood)*p()
+        if beta != 1.0:
+            prob_amenitiesNewnoNorm = {key: value**beta for key, value in prob_amenitiesNewnoNorm.items()}
         summ = sum(list(prob_amenitiesNewnoNorm.values()))
         for key in list(prob_amenitiesNewnoNorm.keys()):
             prob_amenitiesNewNormal[key] = prob_amenitiesNewnoNorm[key]/summ
@@ -371,10 +557,10 @@ class Gibbs():
 #        print ("Probability distribution of the -- amenities -- node without normalization", prob_amenitiesNewnoNorm)
 #        print ("Probability distribution of the -- amenities -- node with normalization", prob_amenitiesNewNormal)
         
-        Update_value = np.random.choice(['lots','little'],p=[prob_amenitiesNewNormal['lots'],prob_amenitiesNewNormal['little']])
+        Update_value = str(np.random.choice(['lots','little'],p=[prob_amenitiesNewNormal['lots'],prob_amenitiesNewNormal['little']]))
         return Update_value
 
-    def probability_neighborhood(self, nonevidList, inpevidenceList):
+    def probability_neighborhood(self, nonevidList, inpevidenceList, beta = 1.0):
 
         '''Calculate the probability distribution for neighborhood node based on Markov Blanket and then
            normalizing it to get it within the 0-1 range '''
@@ -394,6 +580,8 @@ class Gibbs():
                                                             *self.CPT_amentiies(totalList['amenities'])
                                                             
         #p(location|neighborhood,neighborhood)*p()
+        if beta != 1.0:
+            prob_neighborhoodNewnoNorm = {key: value**beta for key, value in prob_neighborhoodNewnoNorm.items()}
         summ = sum(list(prob_neighborhoodNewnoNorm.values()))
         for key in list(prob_neighborhoodNewnoNorm.keys()):
             prob_neighborhoodNewNormal[key] = prob_neighborhoodNewnoNorm[key]/summ
@@ -401,10 +589,10 @@ class Gibbs():
 #        print ("Probability distribution of the -- neighborhood -- node without normalization", prob_neighborhoodNewnoNorm)
 #        print ("Probability distribution of the -- neighborhood -- node with normalization", prob_neighborhoodNewNormal)
         
-        Update_value = np.random.choice(['bad','good'],p=[prob_neighborhoodNewNormal['bad'],prob_neighborhoodNewNormal['good']])
+        Update_value = str(np.random.choice(['bad','good'],p=[prob_neighborhoodNewNormal['bad'],prob_neighborhoodNewNormal['good']]))
         return Update_value
 
-    def probability_size(self, nonevidList, inpevidenceList):
+    def probability_size(self, nonevidList, inpevidenceList, beta = 1.0):
 
         '''Calculate the probability dis\ntribution for size node based on Markov Blanket and then
            normalizing it to get it within the 0-1 range '''
@@ -424,6 +612,8 @@ class Gibbs():
                               self.CPT_schools(totalList['schools'],totalList['children'])
         
         #p(location|size,size)*p()
+        if beta != 1.0:
+            prob_sizeNewnoNorm = {key: value**beta for key, value in prob_sizeNewnoNorm.items()}
         summ = sum(list(prob_sizeNewnoNorm.values()))
         for key in list(prob_sizeNewnoNorm.keys()):
             prob_sizeNewNormal[key] = prob_sizeNewnoNorm[key]/summ
@@ -431,10 +621,10 @@ class Gibbs():
 #        print ("Probability distribution of the -- size -- node without normalization", prob_sizeNewnoNorm)
 #        print ("Probability distribution of the -- size -- node with normalization", prob_sizeNewNormal)
         
-        Update_value = np.random.choice(['small','medium','large'],p=[prob_sizeNewNormal['small'],prob_sizeNewNormal['medium'],prob_sizeNewNormal['large']])
+        Update_value = str(np.random.choice(['small','medium','large'],p=[prob_sizeNewNormal['small'],prob_sizeNewNormal['medium'],prob_sizeNewNormal['large']]))
         return Update_value
     
-    def probability_children(self, nonevidList, inpevidenceList):
+    def probability_children(self, nonevidList, inpevidenceList, beta = 1.0):
 
         '''Calculate the probability distribution for children node based on Markov Blanket and then
            normalizing it to get it within the 0-1 range '''
@@ -453,6 +643,8 @@ class Gibbs():
                                   *self.CPT_schools(totalList['schools'],children_nodeOption)
             
         #p(location|children,children)*p()
+        if beta != 1.0:
+            prob_childrenNewnoNorm = {key: value**beta for key, value in prob_childrenNewnoNorm.items()}
         summ = sum(list(prob_childrenNewnoNorm.values()))
         for key in list(prob_childrenNewnoNorm.keys()):
             prob_childrenNewNormal[key] = prob_childrenNewnoNorm[key]/summ
@@ -460,10 +652,10 @@ class Gibbs():
 #        print ("Probability distribution of the -- children -- node without normalization", prob_childrenNewnoNorm)
 #        print ("Probability distribution of the -- children -- node with normalization", prob_childrenNewNormal)
         
-        Update_value = np.random.choice(['bad','good'],p=[prob_childrenNewNormal['bad'],prob_childrenNewNormal['good']])
+        Update_value = str(np.random.choice(['bad','good'],p=[prob_childrenNewNormal['bad'],prob_childrenNewNormal['good']]))
         return Update_value
     
-    def probability_schools(self, nonevidList, inpevidenceList):
+    def probability_schools(self, nonevidList, inpevidenceList, beta = 1.0):
 
         '''Calculate the probability distribution for schools node based on Markov Blanket and then
            normalizing it to get it with        print ("Probability distribution of the -- schools -- node without normalization", prob_schoolsNewnoNorm)
@@ -487,6 +679,8 @@ class Gibbs():
         
             
         #p(location|schools,schools)*p()
+        if beta != 1.0:
+            prob_schoolsNewnoNorm = {key: value**beta for key, value in prob_schoolsNewnoNorm.items()}
         summ = sum(list(prob_schoolsNewnoNorm.values()))
         for key in list(prob_schoolsNewnoNorm.keys()):
             prob_schoolsNewNormal[key] = prob_schoolsNewnoNorm[key]/summ
@@ -494,10 +688,10 @@ class Gibbs():
 #        print ("Probability distribution of the -- schools -- node without normalization", prob_schoolsNewnoNorm)
 #        print ("Probability distribution of the -- schools -- node with normalization", prob_schoolsNewNormal)
         
-        Update_value = np.random.choice(['bad','good'],p=[prob_schoolsNewNormal['bad'],prob_schoolsNewNormal['good']])
+        Update_value = str(np.random.choice(['bad','good'],p=[prob_schoolsNewNormal['bad'],prob_schoolsNewNormal['good']]))
         return Update_value
 
-    def probability_age(self, nonevidList, inpevidenceList):
+    def probability_age(self, nonevidList, inpevidenceList, beta = 1.0):
 
         '''Calculate the probability distribution for age node based on Markov Blanket and then
            normalizing it to get it within the 0-1 range '''
@@ -518,6 +712,8 @@ class Gibbs():
         
             
         #p(location|age,age)*p()
+        if beta != 1.0:
+            prob_ageNewnoNorm = {key: value**beta for key, value in prob_ageNewnoNorm.items()}
         summ = sum(list(prob_ageNewnoNorm.values()))
         for key in list(prob_ageNewnoNorm.keys()):
             prob_ageNewNormal[key] = prob_ageNewnoNorm[key]/summ
@@ -525,10 +721,10 @@ class Gibbs():
         #print ("Probability distribution of the -- age -- node without normalization", prob_ageNewnoNorm)
         #print ("Probability distribution of the -- age -- node with normalization", prob_ageNewNormal)
         
-        Update_value = np.random.choice(['old','new'],p=[prob_ageNewNormal['old'],prob_ageNewNormal['new']])
+        Update_value = str(np.random.choice(['old','new'],p=[prob_ageNewNormal['old'],prob_ageNewNormal['new']]))
         return Update_value
 
-    def probability_price(self, nonevidList, inpevidenceList):
+    def probability_price(self, nonevidList, inpevidenceList, beta = 1.0):
 
         '''Calculate the probability distribution for price node based on Markov Blanket and then
            normalizing it to get it within the 0-1 range '''
@@ -548,6 +744,8 @@ class Gibbs():
                                                     *self.CPT_size(totalList['size'])*self.CPT_schools(totalList['schools'], totalList['children'])
             
         #p(location|price,price)*p()
+        if beta != 1.0:
+            prob_priceNewnoNorm = {key: value**beta for key, value in prob_priceNewnoNorm.items()}
         summ = sum(list(prob_priceNewnoNorm.values()))
         for key in list(prob_priceNewnoNorm.keys()):
             prob_priceNewNormal[key] = prob_priceNewnoNorm[key]/summ
@@ -555,18 +753,218 @@ class Gibbs():
         #print ("Probability distribution of the -- price -- node without normalization", prob_priceNewnoNorm)
         #print ("Probability distribution of the -- price -- node with normalization", prob_priceNewNormal)
         
-        Update_value = np.random.choice(['cheap','ok','expensive'],p=[prob_priceNewNormal['cheap'],prob_priceNewNormal['ok'],prob_priceNewNormal['expensive']])
+        Update_value = str(np.random.choice(['cheap','ok','expensive'],p=[prob_priceNewNormal['cheap'],prob_priceNewNormal['ok'],prob_priceNewNormal['expensive']]))
         return Update_value
     
+    #Defining a single sweep over all non-evidence nodes, the nodes are visited in random order
+    def sweep(self, nonevidList, inpevidenceList, allValues_noevidList, beta = 1.0):
+
+        '''Resample every non-evidence node once from its conditional raised to the power beta.
+           The new states are written to nonevidList, the estimate is kept by record_query '''
+
+        allValues_length = len(allValues_noevidList)
+
+        #Temporary nodelist to keep track of iterated nodes and prevent multiple iterations in a single loop
+        iterated_nodeList = {} 
+    
+        #Checks length of temporary list to match it with the main list, equal length means iteration over all non-evidence nodes is complete
+        while (len(iterated_nodeList) != allValues_length):
+            #counter += 1
+            #Select a random node based on random probability, eventually iterate through all nodes with the loop
+            randomNode = allValues_noevidList[random.randint(0, len(allValues_noevidList)-1)]
+            if not randomNode in iterated_nodeList.keys():
+                iterated_nodeList[randomNode] = 'status: iterated'
+            
+                #Generates new "state" for the selected node, based on updated probabilities
+                if self.reducedModel:
+                    New_Node_Val = self.probability_reduced(randomNode, nonevidList, inpevidenceList, beta)
+
+                elif randomNode== 'amenities':
+                    New_Node_Val = self.probability_amenities(nonevidList, inpevidenceList, beta)
+                
+                elif randomNode== 'neighborhood':
+                    New_Node_Val = self.probability_neighborhood(nonevidList, inpevidenceList, beta)
+                
+                elif randomNode== 'location':
+                    New_Node_Val = self.probability_location(nonevidList, inpevidenceList, beta)
+                
+                elif randomNode== 'size':
+                    New_Node_Val = self.probability_size(nonevidList, inpevidenceList, beta)
+                
+                elif randomNode== 'children':
+                    New_Node_Val = self.probability_children(nonevidList, inpevidenceList, beta)
+                
+                elif randomNode== 'schools':
+                    New_Node_Val = self.probability_schools(nonevidList, inpevidenceList, beta)
+                
+                elif randomNode== 'age':
+                    New_Node_Val = self.probability_age(nonevidList, inpevidenceList, beta)
+
+                elif randomNode== 'price':
+                    New_Node_Val = self.probability_price(nonevidList, inpevidenceList, beta)
+
+                #Update the main dictionary containing all node states
+                nonevidList[randomNode] = New_Node_Val
+
+    #Defining the joint probability of a complete assignment as the product of the CPT entries of the (pruned) network
+    def joint_log_probability(self, nonevidList, inpevidenceList):
+
+        totalList = dict(nonevidList)
+        totalList.update(inpevidenceList)
+
+        return sum(np.log(self.node_factor(node, totalList)) for node in self.factorNodes)
+
+    def swap_replicas(self, replicas, betas, inpevidenceList):
+
+        '''Propose exchanging the states of every pair of neighbouring replicas, accepting with the
+           Metropolis probability min(1, exp((beta_i - beta_j)*(log p(x_j) - log p(x_i)))) '''
+
+        for pair in range(len(replicas)-1):
+            logRatio = (betas[pair] - betas[pair+1])*(self.joint_log_probability(replicas[pair+1], inpevidenceList)\
+                       - self.joint_log_probability(replicas[pair], inpevidenceList))
+            self.swapAttempts[pair] += 1
+            if logRatio >= 0 or random.random() < np.exp(logRatio):
+                replicas[pair], replicas[pair+1] = replicas[pair+1], replicas[pair]
+                self.swapAccepts[pair] += 1
+
+    #Defining the estimator of the query node, it keeps running totals instead of the history of states
+    def reset_estimator(self, numSweeps):
+
+        '''Start with empty accumulators. The first ignoredSweeps sweeps are the ignored samples, the sweeps
+           after them are grouped into batches of about sqrt(n) sweeps for the batch means estimate of the ESS '''
+
+        self.ignoredSweeps = int(self.numSampleIgnr/len(self.sampledNodes))
+        self.batchSize = max(1, int(np.sqrt(max(numSweeps - self.ignoredSweeps, 1))))
+        self.queryCounts = Counter()
+        self.batchCounts = Counter()
+        self.batchFill = 0
+        self.batchSums = Counter()
+        self.batchSquares = Counter()
+        self.numBatches = 0
+
+    def record_query(self, state, counter):
+
+        '''Add the state of the query node after sweep number counter to the accumulators '''
+
+        if counter < self.ignoredSweeps:
+            return
+        self.queryCounts[state] += 1
+        self.batchCounts[state] += 1
+        self.batchFill += 1
+
+        if self.batchFill == self.batchSize:
+            for option in self.nodeOptions[self.QueryNode]:
+                batchMean = self.batchCounts[option]/float(self.batchSize)
+                self.batchSums[option] += batchMean
+                self.batchSquares[option] += batchMean*batchMean
+            self.numBatches += 1
+            self.batchCounts = Counter()
+            self.batchFill = 0
+
+    def effective_sample_size(self):
+
+        '''Effective number of independent samples of the query node after the ignored samples, taken as
+           the smallest over the indicator chains of its states. Each is the batch means estimate
+           n*var/(batchSize*var of the batch means), which needs at least two complete batches '''
+
+        numSamples = sum(self.queryCounts.values())
+        effectiveSamples = float(numSamples)
+        if self.numBatches < 2:
+            return effectiveSamples
+
+        for option in self.nodeOptions[self.QueryNode]:
+            probability = self.queryCounts[option]/float(numSamples)
+            variance = probability*(1 - probability)
+            batchMean = self.batchSums[option]/self.numBatches
+            batchVariance = (self.batchSquares[option] - self.numBatches*batchMean*batchMean)/(self.numBatches - 1)
+            if variance == 0 or batchVariance <= 0:
+                continue
+            effectiveSamples = min(effectiveSamples, numSamples*variance/(self.batchSize*batchVariance))
+
+        return effectiveSamples
+
+    #Saving and restoring the complete sampler state so that long runs survive preemption
+    def save_checkpoint(self, replicas, counter, samplingTime):
+
+        '''Write the chain state of every replica, the estimator accumulators, the swap counters, both RNG states,
+           the number of completed sweeps and the seconds spent sampling them to the checkpoint file. The file is written to a temporary file first and then renamed,
+           so an interrupted write never corrupts the previous checkpoint. A failed write (full disk, removed
+           directory ...) only prints a warning and returns False, so the run itself is never lost to it '''
+
+        checkpoint = {'QueryNode': self.QueryNode,
+                      'inpevidenceList': self.inpevidenceList,
+                      'numUpdates': self.numUpdates,
+                      'numSampleIgnr': self.numSampleIgnr,
+                      'sampledNodes': self.sampledNodes,
+                      'temperatures': self.temperatures,
+                      'replicas': replicas,
+                      'swapAttempts': self.swapAttempts,
+                      'swapAccepts': self.swapAccepts,
+                      'counter': counter,
+                      'samplingTime': samplingTime,
+                      'estimator': {'ignoredSweeps': self.ignoredSweeps, 'batchSize': self.batchSize,
+                                    'queryCounts': self.queryCounts, 'batchCounts': self.batchCounts, 'batchFill': self.batchFill,
+                                    'batchSums': self.batchSums, 'batchSquares': self.batchSquares, 'numBatches': self.numBatches},
+                      'randomState': random.getstate(),
+                      'npRandomState': np.random.get_state()}
+
+        tmpFile = self.checkpointFile + '.tmp'
+        try:
+            with open(tmpFile, 'wb') as f:
+                pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmpFile, self.checkpointFile)
+        except OSError as error:
+            print ("\nWarning - could not write checkpoint", self.checkpointFile, "--", error, "-- sampling continues")
+            return False
+        return True
+
+    def load_checkpoint(self):
+
+        '''Restore the state written by save_checkpoint and return the replica states together with the
+           number of sweeps already completed '''
+
+        try:
+            with open(self.checkpointFile, 'rb') as f:
+                checkpoint = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as error:
+            print ("\nCould not read checkpoint", self.checkpointFile, "--", error)
+            sys.exit("\nCheck the --checkpoint file, or start the run without --resume")
+
+        if checkpoint['QueryNode'] != self.QueryNode or checkpoint['inpevidenceList'] != self.inpevidenceList:
+            print ("\nCheckpoint was written for query", checkpoint['QueryNode'], "with evidence", checkpoint['inpevidenceList'])
+            sys.exit("\nResume with the same query and evidence as the checkpointed run")
+        if checkpoint['sampledNodes'] != self.sampledNodes:
+            print ("\nCheckpoint was written sampling the nodes", checkpoint['sampledNodes'])
+            sys.exit("\nResume with the same pruning setting as the checkpointed run")
+        if checkpoint['temperatures'] != self.temperatures:
+            print ("\nCheckpoint was written with temperatures", checkpoint['temperatures'])
+            sys.exit("\nResume with the same temperatures as the checkpointed run")
+        if (self.numUpdates is not None and checkpoint['numUpdates'] != self.numUpdates) or checkpoint['numSampleIgnr'] != self.numSampleIgnr:
+            print ("\nCheckpoint was written with -u", checkpoint['numUpdates'], "and -d", checkpoint['numSampleIgnr'])
+            sys.exit("\nResume with the same -u and -d as the checkpointed run (-u may be left out)")
+
+        self.numUpdates = checkpoint['numUpdates']
+        self.numSampleIgnr = checkpoint['numSampleIgnr']
+        self.swapAttempts = checkpoint['swapAttempts']
+        self.swapAccepts = checkpoint['swapAccepts']
+        self.samplingTime = checkpoint['samplingTime']
+        for field, value in checkpoint['estimator'].items():
+            setattr(self, field, value)
+        random.setstate(checkpoint['randomState'])
+        np.random.set_state(checkpoint['npRandomState'])
+
+        return checkpoint['replicas'], checkpoint['counter']
+
     def calculate_probability(self):
         
         checkingNode = self.QueryNode
-        IgnoredSamples = int(self.numSampleIgnr/(len(self.allNodes) - len(list(self.inpevidenceList))))
         if checkingNode == 'amenities':
             
-            ''' Magic line: ignores the given no. of initial observations (defaults to 0 if value not given) 
-                     [note: list does not need to be sorted, but can be sorted if required]'''
-            stateList = Counter({k: self.amenitiesStates[k] for k in list(self.amenitiesStates)[IgnoredSamples:]}.values())
+            ''' Counts of the states recorded by record_query, the given no. of initial observations are
+                already ignored there (defaults to 0 if value not given) '''
+            stateList = self.queryCounts
             
             #Normalizing the readings to obtain probability of state
             lots = stateList['lots']/float(stateList['lots']+stateList['little'])
@@ -575,14 +973,14 @@ class Gibbs():
             
         elif checkingNode == 'neighborhood':
             
-            stateList = Counter({k: self.neighborhoodStates[k] for k in list(self.neighborhoodStates)[IgnoredSamples:]}.values())
+            stateList = self.queryCounts
             bad = stateList['bad']/float(stateList['bad']+stateList['good'])
             good = stateList['good']/float(stateList['bad']+stateList['good'])
             print('Probabilities of states of node -neighborhood- are --> \nbad: ',bad,'  \ngood: ',good)
         
         elif checkingNode == 'location':
             
-            stateList = Counter({k: self.locationStates[k] for k in list(self.locationStates)[IgnoredSamples:]}.values())
+            stateList = self.queryCounts
             bad = stateList['bad']/float(stateList['bad']+stateList['good']+stateList['ugly'])
             good = stateList['good']/float(stateList['bad']+stateList['good']+stateList['ugly'])
             ugly = stateList['ugly']/float(stateList['bad']+stateList['good']+stateList['ugly'])
@@ -590,33 +988,33 @@ class Gibbs():
 
         elif checkingNode == 'children':
             
-            stateList = Counter({k: self.childrenStates[k] for k in list(self.childrenStates)[IgnoredSamples:]}.values())
+            stateList = self.queryCounts
             bad = stateList['bad']/float(stateList['bad']+stateList['good'])
             good = stateList['good']/float(stateList['bad']+stateList['good'])
             print('Probabilities of states of node -children- are --> \nbad: ',bad,'  \ngood: ',good)
             
         elif checkingNode == 'size':
             
-            stateList = Counter({k: self.sizeStates[k] for k in list(self.sizeStates)[IgnoredSamples:]}.values())
+            stateList = self.queryCounts
             small = stateList['small']/float(stateList['small']+stateList['medium']+stateList['large'])
             medium = stateList['medium']/float(stateList['small']+stateList['medium']+stateList['large'])
             large = stateList['large']/float(stateList['small']+stateList['medium']+stateList['large'])
             print('Probabilities of states of node -size- are --> \nsmall: ',small,'  \nmedium: ',medium, '\nlarge: ',large)
             
         elif checkingNode == 'schools':
-            stateList = Counter({k: self.schoolsStates[k] for k in list(self.schoolsStates)[IgnoredSamples:]}.values())
+            stateList = self.queryCounts
             bad = stateList['bad']/float(stateList['bad']+stateList['good'])
             good = stateList['good']/float(stateList['bad']+stateList['good'])
             print('Probabilities of states of node -schools- are --> \nbad: ',bad,'  \ngood: ',good)
  
         elif checkingNode == 'age':
-            stateList = Counter({k: self.ageStates[k] for k in list(self.ageStates)[IgnoredSamples:]}.values())
+            stateList = self.queryCounts
             old = stateList['old']/float(stateList['old']+stateList['new'])
             new = stateList['new']/float(stateList['old']+stateList['new'])
             print('Probabilities of states of node -children- are --> \nold: ',old,'  \nnew: ',new) 
             
         elif checkingNode == 'price':
-            stateList = Counter({k: self.priceStates[k] for k in list(self.priceStates)[IgnoredSamples:]}.values())
+            stateList = self.queryCounts
             cheap = stateList['cheap']/float(stateList['cheap']+stateList['ok']+stateList['expensive'])
             ok = stateList['ok']/float(stateList['cheap']+stateList['ok']+stateList['expensive'])
             expensive = stateList['expensive']/float(stateList['cheap']+stateList['ok']+stateList['expensive'])
@@ -630,19 +1028,35 @@ def main():
     gibbs_obj = Gibbs()
     nonevidList, inpevidenceList, numUpdates, numSampleIgnr, QueryNode, = gibbs_obj.nodeValueSetting()
 
+    #Sweep to start from, non-zero only when continuing a checkpointed run
+    startCounter = 0
+
     allValues_noevidList = list(nonevidList.values())
-    allValues_noevidList = list(nonevidList.keys())
+    allValues_noevidList = list(gibbs_obj.sampledNodes)
     allValues_length = len(allValues_noevidList)
 
     allValues_evidList = list(inpevidenceList.values())
     allValues_evidList = list(inpevidenceList.keys())
 
+    #Replicas for parallel tempering - a single replica at temperature 1 is the plain Gibbs sampler
+    betas = [1.0/temperature for temperature in gibbs_obj.temperatures]
+    swapEvery = gibbs_obj.swapEvery
+    replicas = [nonevidList] + [dict(nonevidList) for _ in betas[1:]]
+
+    if gibbs_obj.resume:
+        replicas, startCounter = gibbs_obj.load_checkpoint()
+        nonevidList = replicas[0]
+        numUpdates, numSampleIgnr = gibbs_obj.numUpdates, gibbs_obj.numSampleIgnr
+        print ("Resuming from checkpoint", gibbs_obj.checkpointFile, "after", startCounter, "sweeps")
+
     print ("Non evidence List", nonevidList)
     print ("Evidence List", inpevidenceList)
 
     print ("Query Node is -- ", QueryNode)
     print ("Number of updates  -- ", numUpdates)
     print ("Number of initial samples to ignore -- ", numSampleIgnr )
+    if len(betas) > 1:
+        print ("Tempering with temperatures -- ", gibbs_obj.temperatures, " swapping every ", swapEvery, " sweeps")
     print ("---------------\n")
     
     '''Iterating over the non-evidence nodes for length of times defined by user'''
@@ -655,74 +1069,54 @@ def main():
     
     #No. of updates can be calculated as follows:
     UpdateNum = int(IterationTimes/allValues_length)
+    if not gibbs_obj.resume:
+        gibbs_obj.reset_estimator(UpdateNum)
     
+    checkpointEvery = gibbs_obj.checkpointEvery
+    lastCheckpoint = time.time()
+
     start = time.time()
-    for counter in range(0,UpdateNum):
+    for counter in range(startCounter,UpdateNum):
 
-        #Temporary nodelist to keep track of iterated nodes and prevent multiple iterations in a single loop
-        iterated_nodeList = {} 
-        
-        #Checks length of temporary list to match it with the main list, equal length means iteration over all non-evidence nodes is complete
-        while (len(list(iterated_nodeList)) != allValues_length):
-            #counter += 1
-            #Select a random node based on random probability, eventually iterate through all nodes with the loop
-            randomNode = allValues_noevidList[random.randint(0, len(allValues_noevidList)-1)]
-            if not randomNode in iterated_nodeList.keys():
-                iterated_nodeList[randomNode] = 'status: iterated'
-                
-                if randomNode== 'amenities':
-                    
-                    #Generates new "state" for the selected node, based on updated probabilities
-                    New_Node_Val = gibbs_obj.probability_amenities(nonevidList, inpevidenceList)
-                    
-                    #Update the main dictionary containing all node states
-                    nonevidList[randomNode] = New_Node_Val
-                    
-                    #Append the result to a cumulitive dictionary to keep track of all states received so far
-                    gibbs_obj.amenitiesStates[counter] = New_Node_Val
-                    
-                elif randomNode== 'neighborhood':
-                    New_Node_Val = gibbs_obj.probability_neighborhood(nonevidList, inpevidenceList)
-                    nonevidList[randomNode] = New_Node_Val
-                    gibbs_obj.neighborhoodStates[counter] = New_Node_Val
-                    
-                elif randomNode== 'location':
-                    New_Node_Val = gibbs_obj.probability_location(nonevidList, inpevidenceList)
-                    nonevidList[randomNode] = New_Node_Val
-                    gibbs_obj.locationStates[counter] = New_Node_Val
-                    
-                elif randomNode== 'size':
-                    New_Node_Val = gibbs_obj.probability_size(nonevidList, inpevidenceList)
-                    nonevidList[randomNode] = New_Node_Val
-                    gibbs_obj.sizeStates[counter] = New_Node_Val         
-                    
-                elif randomNode== 'children':
-                    New_Node_Val = gibbs_obj.probability_children(nonevidList, inpevidenceList)
-                    nonevidList[randomNode] = New_Node_Val
-                    gibbs_obj.childrenStates[counter] = New_Node_Val
-                    
-                elif randomNode== 'schools':
-                    New_Node_Val = gibbs_obj.probability_schools(nonevidList, inpevidenceList)
-                    nonevidList[randomNode] = New_Node_Val
-                    gibbs_obj.schoolsStates[counter] = New_Node_Val
-                    
-                elif randomNode== 'age':
-                    New_Node_Val = gibbs_obj.probability_age(nonevidList, inpevidenceList)
-                    nonevidList[randomNode] = New_Node_Val
-                    gibbs_obj.ageStates[counter] = New_Node_Val
+        #One sweep per replica, only the query state of the untempered replica (beta = 1) goes into the estimate
+        for replica, beta in zip(replicas, betas):
+            gibbs_obj.sweep(replica, inpevidenceList, allValues_noevidList, beta)
+        gibbs_obj.record_query(replicas[0][QueryNode], counter)
 
-                elif randomNode== 'price':
-                    New_Node_Val = gibbs_obj.probability_price(nonevidList, inpevidenceList)
-                    nonevidList[randomNode] = New_Node_Val
-                    gibbs_obj.priceStates[counter] = New_Node_Val
+        #Proposing state swaps between neighbouring temperatures
+        if len(replicas) > 1 and (counter+1) % swapEvery == 0:
+            gibbs_obj.swap_replicas(replicas, betas, inpevidenceList)
         #print('Iteration: ',counter,'\n')
+
+        #Checkpoint once checkpointEvery seconds have passed - the checkpoint holds only the current states and fixed-size accumulators
+        if checkpointEvery and time.time() - lastCheckpoint >= checkpointEvery:
+            gibbs_obj.save_checkpoint(replicas, counter+1, gibbs_obj.samplingTime + time.time() - start)
+            lastCheckpoint = time.time()
         
-    #Final function which calculates probability based on states recorded of the query node
+    #Final function which calculates probability based on the recorded states of the query node
     gibbs_obj.calculate_probability()
     end = time.time()
     print('\nElapsed time - ',end-start,' seconds')
-
-main()
+    if gibbs_obj.resume:
+        print('Elapsed time including the checkpointed runs - ', gibbs_obj.samplingTime + end-start, ' seconds')
+
+    #Final checkpoint, written after the results are printed so the file always matches the finished run
+    if checkpointEvery and gibbs_obj.save_checkpoint(replicas, UpdateNum, gibbs_obj.samplingTime + end-start):
+        print ("Checkpoint written to", gibbs_obj.checkpointFile, "after", UpdateNum, "sweeps")
+
+    #Run stats to compare the plain and the tempered sampler
+    print('Sampled nodes - ', gibbs_obj.sampledNodes)
+    print('Pruned barren nodes - ', gibbs_obj.barrenNodes, ' pruned d-separated nodes - ', gibbs_obj.dseparatedNodes)
+    effectiveSamples = gibbs_obj.effective_sample_size()
+    print('Effective samples of -', QueryNode, '- ', effectiveSamples)
+    print('Effective samples per second - ', effectiveSamples/(gibbs_obj.samplingTime + end-start))
+    for pair in range(len(betas)-1):
+        attempts = gibbs_obj.swapAttempts[pair]
+        rate = gibbs_obj.swapAccepts[pair]/float(attempts) if attempts else 0.0
+        print('Swap acceptance rate T =', gibbs_obj.temperatures[pair], '<-> T =', gibbs_obj.temperatures[pair+1], ' - ', rate)
+
+if __name__ == '__main__':
+    main()
 
     
 
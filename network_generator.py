@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+import numpy as np
+import random
+
+from gibbs import Gibbs
+
+class RandomNetwork(Gibbs):
+
+    ''' Random DAG Bayesian network that the Gibbs sampler can run on, in place of the housing network
+
+    Nodes are named n0, n1, ... in topological order and every node picks its parents uniformly among the
+    nodes before it. Each CPT row is drawn from a symmetric Dirichlet distribution - the higher the sharpness,
+    the closer the rows are to deterministic. Entries are floored at minProb, like the 0.0001 entries of the
+    housing price CPT, so that no conditional ever sums to zero.
+
+    The network is described through the same attributes as the housing network - allNodes, nodeOptions,
+    parents and cptFunctions - so pruning, the reduced-model conditionals and the tempering swaps work unchanged.
+
+    --Parameters
+    numNodes        - Number of nodes in the network
+    maxParents      - Largest number of parents of a node (in-degree)
+    cardinalities   - Number of states a node may have, picked uniformly per node
+    sharpness       - Sharpness of the CPT rows, the Dirichlet concentration is 1/sharpness
+    minProb         - Smallest CPT entry
+    seed            - Seed for the structure and the CPTs, sampling itself still uses the global RNGs
+
+    -- Example
+    network = RandomNetwork(1000, maxParents=3, cardinalities=(2, 3), sharpness=4.0, seed=7)
+    '''
+
+    def __init__(self, numNodes, maxParents = 2, cardinalities = (2, 3), sharpness = 1.0, minProb = 0.0001, seed = None):
+        Gibbs.__init__(self)
+        if sharpness <= 0 or maxParents < 0:
+            raise ValueError('sharpness must be positive and maxParents must not be negative')
+        generator = np.random.RandomState(seed)
+
+        self.allNodes = ['n' + str(index) for index in range(numNodes)]
+        self.factorNodes = list(self.allNodes)
+        self.nodeOptions = {}
+        self.parents = {}
+        self.cptTables = {}
+        self.cptFunctions = {}
+
+        for index, node in enumerate(self.allNodes):
+            numStates = cardinalities[generator.randint(len(cardinalities))]
+            self.nodeOptions[node] = ['s' + str(state) for state in range(numStates)]
+
+            numParents = generator.randint(min(maxParents, index) + 1)
+            parentIndices = sorted(generator.choice(index, numParents, replace=False)) if numParents else []
+            self.parents[node] = [self.allNodes[parentIndex] for parentIndex in parentIndices]
+
+            self.cptTables[node] = self.random_cpt(node, generator, sharpness, minProb)
+            self.cptFunctions[node] = self.cpt_lookup(self.cptTables[node])
+
+    def random_cpt(self, node, generator, sharpness, minProb):
+
+        '''CPT of a node as a dictionary from the tuple of parent states to a dictionary from the node state
+           to its probability, one Dirichlet draw per row. At high sharpness every gamma variate behind the draw
+           can underflow to zero and the row comes out as NaN - such a row is taken as a one-hot row instead,
+           the limit the Dirichlet draw tends to '''
+
+        options = self.nodeOptions[node]
+        parentRows = [()]
+        for parent in self.parents[node]:
+            parentRows = [row + (parentState,) for row in parentRows for parentState in self.nodeOptions[parent]]
+
+        table = {}
+        for row in parentRows:
+            probabilities = generator.dirichlet([1.0/sharpness]*len(options))
+            if not np.all(np.isfinite(probabilities)):
+                probabilities = np.eye(len(options))[generator.randint(len(options))]
+            probabilities = np.maximum(probabilities, minProb)
+            probabilities = probabilities/probabilities.sum()
+            table[row] = dict(zip(options, probabilities.tolist()))
+        return table
+
+    #Defining the CPT function of a node, called like CPT_location with the node state followed by its parent states
+    def cpt_lookup(self, table):
+        return lambda node_cond, *parentStates: table[parentStates][node_cond]
+
+    def prune_network(self):
+        Gibbs.prune_network(self)
+
+        #There are no hand-written conditionals for a generated network, so it is always sampled as a reduced model
+        self.reducedModel = True
+        return self.sampledNodes
+
+    #Defining the function that randomly assigns a state to every node that is not evidence
+    def random_assignment(self):
+        return {node: self.nodeOptions[node][random.randint(0, len(self.nodeOptions[node])-1)]
+                for node in self.allNodes if node not in self.inpevidenceList}
+
+    def exact_root_marginal(self, node):
+
+        '''Exact marginal of a root node, which is its CPT - used as the reference answer when the network is
+           sampled without evidence '''
+
+        if self.parents[node]:
+            raise ValueError('Exact marginal is only available for root nodes, ' + node + ' has parents ' + str(self.parents[node]))
+        return dict(self.cptTables[node][()])
+
+    def num_edges(self):
+        return sum(len(self.parents[node]) for node in self.allNodes)
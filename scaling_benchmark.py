@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+
+''' Scaling benchmark of the Gibbs sampler on generated random networks
+
+For every network size a RandomNetwork is generated and sampled without evidence for a fixed amount of time.
+The query is the root n0, whose exact marginal is its own CPT, and which is connected to the rest of the network
+through its children, so how fast its estimate converges shows how well the whole chain mixes.
+
+The sampler records the query the way gibbs.py does, into the fixed-size accumulators of record_query, so it keeps
+no per-sweep history and its memory does not grow with the run.
+
+Recorded per network size -
+    sweeps and node updates per second
+    network MiB - memory allocated by the generated network (structure and CPTs), measured with tracemalloc
+    peak MiB    - peak traced memory while sampling a few sweeps - network, chain state, accumulators and the
+                  temporaries of a sweep. Measured in a separate pass, as tracemalloc slows the sampler down
+    time to target accuracy - time after which the total variation distance between the estimated and the
+                              exact marginal of n0 stays below the target until the end of the run. A time only
+                              counts once the chain of n0 has visited at least two of its states
+
+Limitation - the accuracy column measures how the chain of n0 mixes only when n0 does change state. With very
+sharp CPTs n0's marginal can be nearly one-hot, and a chain that starts in the mode and never leaves it reaches a
+tiny error without mixing at all. Such runs are reported as "n0 never moved" rather than as a time, so a
+near-deterministic n0 shows up as unreached even when the sampler would be right to stay put.
+
+-- Input Syntax
+scaling_benchmark.py [-h] [--nodes N1,N2,...] [--max-parents K] [--cardinalities C1,C2,...] [--sharpness S]
+                     [--seconds T] [--target E] [--seed SEED]
+
+-- Example Input command
+python3 scaling_benchmark.py --nodes 10,100,1000,10000 --max-parents 3 --sharpness 4 --seconds 60
+'''
+
+import numpy as np
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+
+from network_generator import RandomNetwork
+
+def read_argument():
+
+    parser = argparse.ArgumentParser(description='Scaling benchmark of the Gibbs sampler on random networks')
+
+    parser.add_argument('--nodes', type=str, help='Comma separated network sizes', default = '10,100,1000,10000')
+    parser.add_argument('--max-parents', type=int, help='Largest number of parents of a node', default = 2)
+    parser.add_argument('--cardinalities', type=str, help='Comma separated numbers of states a node may have', default = '2,3')
+    parser.add_argument('--sharpness', type=float, help='Sharpness of the CPT rows', default = 1.0)
+    parser.add_argument('--seconds', type=float, help='Sampling time per network size', default = 30)
+    parser.add_argument('--target', type=float, help='Target total variation distance of the query estimate', default = 0.01)
+    parser.add_argument('--seed', type=int, help='Seed for the networks and the sampler', default = 0)
+
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.nodes.split(',')]
+    cardinalities = tuple(int(cardinality) for cardinality in args.cardinalities.split(','))
+    if min(sizes) < 1 or min(cardinalities) < 2:
+        sys.exit("\nNetwork sizes must be positive and nodes need at least 2 states")
+    if args.sharpness <= 0 or args.max_parents < 0:
+        sys.exit("\n--sharpness must be positive and --max-parents must not be negative")
+
+    return sizes, args.max_parents, cardinalities, args.sharpness, args.seconds, args.target, args.seed
+
+#Defining the run on a single network size, returns the row of the results table
+def benchmark_network(numNodes, maxParents, cardinalities, sharpness, seconds, target, seed):
+
+    #Memory pass - size of the network, then the peak over a few sweeps
+    tracemalloc.start()
+    network = RandomNetwork(numNodes, maxParents, cardinalities, sharpness, seed=seed)
+    network.QueryNode = network.allNodes[0]
+    network.prune = False
+    network.prune_network()
+    networkMemory = tracemalloc.get_traced_memory()[0]
+
+    random.seed(seed)
+    np.random.seed(seed)
+    nonevidList = network.random_assignment()
+    network.reset_estimator(0)
+    for counter in range(3):
+        network.sweep(nonevidList, network.inpevidenceList, network.sampledNodes)
+        network.record_query(nonevidList[network.QueryNode], counter)
+    peakMemory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    #Timed pass, from the same starting state
+    random.seed(seed)
+    np.random.seed(seed)
+    nonevidList = network.random_assignment()
+    network.reset_estimator(0)
+
+    exactMarginal = network.exact_root_marginal(network.QueryNode)
+    sampledNodes = network.sampledNodes
+    error, reachedAt, sweeps, moved = 1.0, None, 0, False
+
+    start = time.time()
+    while time.time() - start < seconds:
+        network.sweep(nonevidList, network.inpevidenceList, sampledNodes)
+        network.record_query(nonevidList[network.QueryNode], sweeps)
+        sweeps += 1
+
+        error = 0.5*sum(abs(network.queryCounts[state]/float(sweeps) - exactMarginal[state]) for state in exactMarginal)
+        moved = moved or len(network.queryCounts) > 1
+        if error > target or not moved:
+            reachedAt = None
+        elif reachedAt is None:
+            reachedAt = time.time() - start
+    elapsed = time.time() - start
+
+    return {'nodes': numNodes, 'edges': network.num_edges(), 'sweeps': sweeps,
+            'updatesPerSecond': sweeps*len(sampledNodes)/elapsed,
+            'networkMemoryMiB': networkMemory/2.0**20, 'peakMemoryMiB': peakMemory/2.0**20,
+            'timeToTarget': reachedAt, 'moved': moved, 'finalError': error}
+
+def main():
+    sizes, maxParents, cardinalities, sharpness, seconds, target, seed = read_argument()
+
+    print ("Network sizes -- ", sizes)
+    print ("Largest number of parents -- ", maxParents, "  node cardinalities -- ", cardinalities, "  CPT sharpness -- ", sharpness)
+    print ("Sampling time per size -- ", seconds, " seconds, target total variation -- ", target)
+    print ("---------------\n")
+
+    #Throwaway network and sweep, so one-off allocations of the first use are not counted against the smallest size
+    warmup = RandomNetwork(2, seed=seed)
+    warmup.QueryNode = warmup.allNodes[0]
+    warmup.prune_network()
+    warmup.sweep(warmup.random_assignment(), {}, warmup.sampledNodes)
+
+    print ('%8s %8s %10s %14s %12s %12s %16s %12s' % ('nodes', 'edges', 'sweeps', 'updates/s', 'network MiB', 'peak MiB', 'time to target', 'final TV'))
+    for numNodes in sorted(sizes):
+        row = benchmark_network(numNodes, maxParents, cardinalities, sharpness, seconds, target, seed)
+        if row['timeToTarget'] is not None:
+            timeToTarget = '%.2f s' % row['timeToTarget']
+        else:
+            timeToTarget = 'not reached' if row['moved'] else 'n0 never moved'
+        print ('%8d %8d %10d %14.0f %12.2f %12.2f %16s %12.4f' % (row['nodes'], row['edges'], row['sweeps'], row['updatesPerSecond'],
+                                                                 row['networkMemoryMiB'], row['peakMemoryMiB'], timeToTarget, row['finalError']))
+        sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()